@@ -0,0 +1,78 @@
+"""Notebook discovery shared by the CI scripts.
+
+Both `execute_notebooks.py` and `generate_notebooks_page.py` list notebooks with
+the same skip rules; they live here so the two can't drift apart.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+from fnmatch import translate
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+
+
+# All hidden names are skipped as well: `.github`, the only dot-folder that was
+# ever exempt from that rule, is skipped explicitly anyway.
+_SKIP_PARTS = frozenset({".ipynb_checkpoints", "_site", ".quarto", ".git", ".github"})
+
+
+def compile_exclude_matcher(patterns: Iterable[str]) -> Callable[[str], bool] | None:
+    # Translate all globs into a single regex once, instead of running fnmatch
+    # (and its glob->regex translation) per pattern and path.
+    patterns = tuple(patterns)
+    if not patterns:
+        return None
+    regex = re.compile("|".join(translate(p) for p in patterns))
+    return lambda repo_relative_posix: regex.match(repo_relative_posix) is not None
+
+
+def compile_dir_exclude_matcher(patterns: Iterable[str]) -> Callable[[str], bool] | None:
+    # A pattern like `experiments/**` or `exp*/*` matches every path below a
+    # directory that matches the part before the last slash (fnmatch's `*` also
+    # matches `/`), so such directories don't have to be walked at all.
+    prefixes = []
+    for p in patterns:
+        head = p.rstrip("*")
+        if head != p and head.endswith("/") and len(head) > 1:
+            prefixes.append(head[:-1])
+    return compile_exclude_matcher(prefixes)
+
+
+def _walk(
+    directory: str, rel_dir: str, is_dir_excluded: Callable[[str], bool] | None
+) -> Iterator[tuple[str, str]]:
+    # Yields (repo-relative posix path, filesystem path) pairs. The relative path
+    # is built alongside the walk, so no Path objects are needed for matching.
+    # Skipped, hidden and excluded directories are pruned before descending, so
+    # e.g. `.git` or `_site` are never listed at all.
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name[0] == "." or name in _SKIP_PARTS:
+                    continue
+                rel = rel_dir + name
+                if is_dir_excluded and is_dir_excluded(rel):
+                    continue
+                yield from _walk(entry.path, rel + "/", is_dir_excluded)
+            elif name.endswith(".ipynb") and name[0] != ".":
+                yield rel_dir + name, entry.path
+
+
+def iter_notebooks(root: Path, exclude_patterns: Iterable[str] = ()) -> Iterator[Path]:
+    # Skip checkpoints, Quarto build outputs, hidden folders and excluded paths.
+    exclude_patterns = tuple(exclude_patterns)
+    is_excluded = compile_exclude_matcher(exclude_patterns)
+    is_dir_excluded = compile_dir_exclude_matcher(exclude_patterns)
+    for rel, path in _walk(str(root), "", is_dir_excluded):
+        if is_excluded and is_excluded(rel):
+            continue
+        yield Path(path)
+
+
+def discover(root: Path, *, exclude_patterns: Iterable[str] = ()) -> list[Path]:
+    # All notebooks below `root` that are not excluded, sorted case-insensitively
+    # by path.
+    return sorted(iter_notebooks(root, exclude_patterns), key=lambda p: p.as_posix().lower())
@@ -4,11 +4,23 @@ This is intended for CI usage (e.g. a scheduled GitHub Action) to keep rendered
 notebook outputs up-to-date without manual intervention.
 
 Usage:
-  python .github/scripts/execute_notebooks.py
+  python .github/scripts/execute_notebooks.py [--isolated]
+
+By default notebooks are executed in-process with nbclient, and every worker
+reuses one kernel for all notebooks it runs (the namespace is reset in between).
+Pass --isolated to execute the notebooks with nbconvert processes and a fresh
+kernel per notebook instead (one process per notebook with FAIL_FAST, otherwise
+up to 16 notebooks per process).
 
 Environment variables (optional):
   NOTEBOOK_TIMEOUT_SECONDS  Per-notebook execution timeout (default: 1800)
   FAIL_FAST                 "1" to stop on first failure (default: 1)
+  NOTEBOOK_JOBS             Number of notebooks executed in parallel
+                            (default: number of CPUs)
+  NOTEBOOK_EXEC_CACHE       "1" to skip notebooks whose code cells and
+                            requirements are unchanged since their last
+                            successful run (default: 0, since the notebooks
+                            usually query live data)
     NOTEBOOK_EXCLUDE           Comma-separated glob patterns (repo-relative) to skip
                                                         e.g. "statistic-federal_state.ipynb,experiments/**"
                                                         You can also add patterns to .github/notebook-excludes.txt
@@ -16,19 +28,66 @@ Environment variables (optional):
 
 from __future__ import annotations
 
+import argparse
+import functools
+import hashlib
+import json
 import os
+import re
 import subprocess
 import sys
-from fnmatch import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Iterable
+from typing import Callable
+
+import nbformat
+from jupyter_client.manager import KernelManager
+from nbclient import NotebookClient
+
+from _nb_discovery import discover
 
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
+# Length of the "<repo root>/" prefix of every discovered notebook path.
+_ROOT_PREFIX_LEN = len(REPO_ROOT.as_posix()) + 1
 EXCLUDES_FILE = REPO_ROOT / ".github" / "notebook-excludes.txt"
+EXEC_CACHE_FILE = REPO_ROOT / ".github" / ".nb-exec-cache.json"
+# Files describing the execution environment; part of every notebook's hash.
+ENVIRONMENT_FILES = ("requirements.txt", "runtime.txt", "environment.yml")
+KERNEL_NAME = "python3"
+# Maximum number of notebooks passed to a single nbconvert process (see
+# `run_notebook_batch`).
+BATCH_SIZE = 16
+
+# nbconvert logs this line before it starts each notebook.
+_CONVERTING_RE = re.compile(r"^\[NbConvertApp\] Converting notebook .+ to notebook$", re.MULTILINE)
+
+# Kernels started by worker threads (see `_worker_kernel`), shut down in `main`.
+_kernels: list[KernelManager] = []
+# Kernels currently executing a notebook; only these get interrupted on cancel.
+_executing: set[KernelManager] = set()
+_kernels_lock = threading.Lock()
+_local = threading.local()
+
+# nbconvert processes currently running (see `run_notebook`).
+_processes: set[subprocess.Popen] = set()
+_processes_lock = threading.Lock()
+
+# Set on the first failure in fail-fast mode; running notebooks are stopped.
+_cancelled = threading.Event()
 
 
-def _load_exclude_patterns() -> list[str]:
+class NotebookCancelled(Exception):
+    pass
+
+
+# (notebook, captured output, failure message or None)
+Result = tuple[Path, str, str | None]
+
+
+@functools.lru_cache(maxsize=1)
+def _load_exclude_patterns() -> tuple[str, ...]:
     patterns: list[str] = []
 
     env = os.getenv("NOTEBOOK_EXCLUDE", "").strip()
@@ -53,37 +112,49 @@ def _load_exclude_patterns() -> list[str]:
             continue
         seen.add(p)
         unique.append(p)
-    return unique
+    return tuple(unique)
 
 
-def _is_excluded(repo_relative_posix: str, patterns: list[str]) -> bool:
-    for pat in patterns:
-        if fnmatch(repo_relative_posix, pat):
-            return True
-    return False
+def _environment_digest() -> bytes:
+    h = hashlib.sha256()
+    for name in ENVIRONMENT_FILES:
+        path = REPO_ROOT / name
+        if path.is_file():
+            h.update(name.encode("utf-8") + b"\0" + path.read_bytes() + b"\0")
+    return h.digest()
 
 
-def iter_notebooks(root: Path) -> Iterable[Path]:
-    skip_parts = {".ipynb_checkpoints", "_site", ".quarto", ".git", ".github"}
+def notebook_hash(notebook: Path, environment_digest: bytes) -> str | None:
+    # Hash of the notebook's code cells plus the environment. Outputs and
+    # markdown are left out, so re-executing doesn't change the hash.
+    try:
+        data = json.loads(notebook.read_bytes())
+    except (OSError, ValueError):
+        return None
 
-    exclude_patterns = _load_exclude_patterns()
-
-    for path in root.rglob("*.ipynb"):
-        if any(part in skip_parts for part in path.parts):
-            continue
-        if any(part.startswith(".") and part not in {".github"} for part in path.parts):
+    h = hashlib.sha256(environment_digest)
+    for cell in data.get("cells", []):
+        if cell.get("cell_type") != "code":
             continue
+        source = cell.get("source") or ""
+        if not isinstance(source, str):
+            source = "".join(source)
+        h.update(source.encode("utf-8") + b"\0")
+    return h.hexdigest()
 
-        if exclude_patterns:
-            rel = path.relative_to(REPO_ROOT).as_posix()
-            if _is_excluded(rel, exclude_patterns):
-                continue
-        yield path
 
+def _load_exec_cache() -> dict[str, str]:
+    try:
+        data = json.loads(EXEC_CACHE_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
 
-def run_notebook(notebook: Path, timeout_seconds: int) -> None:
-    # Use nbconvert to execute and write outputs back into the original notebook.
+
+def _nbconvert(notebooks: list[Path], timeout_seconds: int) -> str:
+    # Use nbconvert to execute and write outputs back into the original notebooks.
     # We invoke it via `python -m jupyter` to avoid PATH issues.
+    # Output is captured (and returned) so parallel runs don't interleave logs.
     cmd = [
         sys.executable,
         "-m",
@@ -94,14 +165,206 @@ def run_notebook(notebook: Path, timeout_seconds: int) -> None:
         "--execute",
         "--inplace",
         f"--ExecutePreprocessor.timeout={timeout_seconds}",
-        "--ExecutePreprocessor.kernel_name=python3",
-        str(notebook),
+        f"--ExecutePreprocessor.kernel_name={KERNEL_NAME}",
+        *map(str, notebooks),
     ]
 
-    subprocess.run(cmd, cwd=str(REPO_ROOT), check=True)
+    if _cancelled.is_set():
+        raise NotebookCancelled(notebooks[0])
+    proc = subprocess.Popen(
+        cmd,
+        cwd=str(REPO_ROOT),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    with _processes_lock:
+        _processes.add(proc)
+    try:
+        # `_cancel_running` may have missed the process if it was just starting.
+        if _cancelled.is_set():
+            proc.terminate()
+        stdout, stderr = proc.communicate()
+    finally:
+        with _processes_lock:
+            _processes.discard(proc)
+
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+    return (stdout or "") + (stderr or "")
+
+
+def run_notebook(notebook: Path, timeout_seconds: int) -> str:
+    return _nbconvert([notebook], timeout_seconds)
+
+
+def _split_log(log: str, count: int) -> list[str]:
+    # Split a batch log at the "Converting notebook" lines, one part per started
+    # notebook (anything before the first one is kept with the first part).
+    starts = [m.start() for m in _CONVERTING_RE.finditer(log)][:count]
+    if not starts:
+        return [log]
+    starts[0] = 0
+    return [log[a:b] for a, b in zip(starts, starts[1:] + [len(log)])]
+
+
+def run_notebook_batch(notebooks: list[Path], timeout_seconds: int) -> list[Result]:
+    # Execute several notebooks with one nbconvert process, which saves a Python
+    # start-up and the nbconvert import per notebook. nbconvert processes the
+    # notebooks in order and stops at the first one that fails: that one is
+    # reported as failed and the rest are run by a new process.
+    results: list[Result] = []
+    pending = list(notebooks)
+    while pending:
+        try:
+            log = _nbconvert(pending, timeout_seconds)
+        except subprocess.CalledProcessError as exc:
+            log = (exc.stdout or "") + (exc.stderr or "")
+            parts = _split_log(log, len(pending))
+            failed = len(parts) - 1
+            msg = f"Execution failed with exit code {exc.returncode}"
+            results += [(nb, part, None) for nb, part in zip(pending, parts[:failed])]
+            results.append((pending[failed], parts[failed], msg))
+            pending = pending[failed + 1 :]
+            continue
+        parts = _split_log(log, len(pending))
+        parts += [""] * (len(pending) - len(parts))
+        results += [(nb, part, None) for nb, part in zip(pending, parts)]
+        break
+    return results
+
+
+def _file_size(path: Path) -> int:
+    # Sort key only: a notebook that can't be stat'ed (e.g. a dangling symlink)
+    # goes first and then fails through the normal execution path.
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
 
+def _run_single(
+    runner: Callable[[Path, int], str], notebook: Path, timeout_seconds: int
+) -> list[Result]:
+    try:
+        output = runner(notebook, timeout_seconds)
+    except subprocess.CalledProcessError as exc:
+        output = (exc.stdout or "") + (exc.stderr or "")
+        return [(notebook, output, f"Execution failed with exit code {exc.returncode}")]
+    except Exception as exc:
+        # nbclient errors: CellExecutionError, timeouts, dead kernels
+        return [(notebook, str(exc), f"Execution failed ({type(exc).__name__})")]
+    return [(notebook, output, None)]
+
+
+def _worker_kernel() -> KernelManager:
+    # One kernel per worker thread, reused for every notebook that worker runs.
+    km = getattr(_local, "km", None)
+    if km is None:
+        km = KernelManager(kernel_name=KERNEL_NAME)
+        km.start_kernel(cwd=str(REPO_ROOT))
+        _local.km = km
+        with _kernels_lock:
+            _kernels.append(km)
+    elif getattr(_local, "needs_restart", False):
+        km.restart_kernel(now=True)
+    _local.needs_restart = False
+    return km
+
+
+def _reset_kernel(km: KernelManager, cwd: Path) -> None:
+    # Drop everything the previous notebook defined and switch to the notebook's
+    # directory, which is where nbconvert would start a fresh kernel.
+    kc = km.client()
+    kc.start_channels()
+    try:
+        kc.wait_for_ready(timeout=60)
+        kc.execute_interactive(
+            f"%reset -f\n__import__('os').chdir({str(cwd)!r})",
+            store_history=False,
+            timeout=60,
+        )
+    finally:
+        kc.stop_channels()
+
+
+def _check_cancelled(**_: object) -> None:
+    # Also used as nbclient's `on_cell_start` hook.
+    if _cancelled.is_set():
+        raise NotebookCancelled()
+
+
+def run_notebook_shared(notebook: Path, timeout_seconds: int) -> str:
+    # Execute in-process on the worker's kernel and write outputs back in place,
+    # saving a Python start-up plus a kernel start-up per notebook.
+    if _cancelled.is_set():
+        raise NotebookCancelled(notebook)
+    km = _worker_kernel()
+    with _kernels_lock:
+        _executing.add(km)
+    try:
+        _reset_kernel(km, notebook.parent)
+        nb = nbformat.read(notebook, as_version=4)
+        client = NotebookClient(
+            nb,
+            km=km,
+            timeout=timeout_seconds,
+            kernel_name=KERNEL_NAME,
+            on_cell_start=_check_cancelled,
+        )
+        # A cancel may have come in while the kernel was starting or resetting;
+        # an interrupt sent then is lost, so check again before every cell.
+        _check_cancelled()
+        try:
+            client.execute()
+        finally:
+            # The client doesn't own `km`, so it leaves its own channels open.
+            if client.kc is not None:
+                client.kc.stop_channels()
+    except Exception:
+        # The kernel may still be busy (timeout) or dead; the next notebook on
+        # this worker gets a restarted one. The restart is deferred so a
+        # fail-fast run, which starts no further notebooks, doesn't pay for it.
+        _local.needs_restart = True
+        raise
+    finally:
+        with _kernels_lock:
+            _executing.discard(km)
+    nbformat.write(nb, notebook)
+    return ""
+
+
+def _cancel_running() -> None:
+    # Fail-fast: the results of notebooks still running are no longer needed,
+    # so stop them instead of waiting for them to finish.
+    _cancelled.set()
+    with _processes_lock:
+        for proc in _processes:
+            proc.terminate()
+    with _kernels_lock:
+        for km in _executing:
+            km.interrupt_kernel()
+
+
+def _shutdown_kernels() -> None:
+    with _kernels_lock:
+        for km in _kernels:
+            km.shutdown_kernel(now=True)
+        _kernels.clear()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Execute notebooks in-place.")
+    parser.add_argument(
+        "--isolated",
+        action="store_true",
+        help=(
+            "run notebooks with nbconvert processes and a fresh kernel per notebook "
+            f"(one process per notebook with FAIL_FAST, otherwise up to {BATCH_SIZE} per process)"
+        ),
+    )
+    args = parser.parse_args(argv)
 
-def main() -> int:
     timeout_seconds = int(os.getenv("NOTEBOOK_TIMEOUT_SECONDS", "1800"))
     fail_fast = os.getenv("FAIL_FAST", "1") != "0"
 
@@ -111,7 +374,8 @@ def main() -> int:
         for p in exclude_patterns:
             print(f"- {p}")
 
-    notebooks = sorted(iter_notebooks(REPO_ROOT), key=lambda p: p.as_posix().lower())
+    # Excluded directories are not walked at all.
+    notebooks = discover(REPO_ROOT, exclude_patterns=exclude_patterns)
     if not notebooks:
         msg = "No notebooks found."
         if exclude_patterns:
@@ -119,19 +383,78 @@ def main() -> int:
         print(msg)
         return 0
 
-    failures: list[tuple[Path, str]] = []
-
-    for nb in notebooks:
-        rel = nb.relative_to(REPO_ROOT)
-        print(f"\n=== Executing: {rel} ===")
-        try:
-            run_notebook(nb, timeout_seconds=timeout_seconds)
-        except subprocess.CalledProcessError as exc:
-            msg = f"Execution failed with exit code {exc.returncode}"
-            failures.append((rel, msg))
-            print(msg)
-            if fail_fast:
-                return 1
+    exec_cache: dict[str, str] = {}
+    hashes: dict[Path, str | None] = {}
+    use_exec_cache = os.getenv("NOTEBOOK_EXEC_CACHE", "0") == "1"
+    if use_exec_cache:
+        exec_cache = _load_exec_cache()
+        environment_digest = _environment_digest()
+        pending: list[Path] = []
+        for nb in notebooks:
+            rel = nb.as_posix()[_ROOT_PREFIX_LEN:]
+            hashes[nb] = notebook_hash(nb, environment_digest)
+            if hashes[nb] is not None and exec_cache.get(rel) == hashes[nb]:
+                print(f"Unchanged since last successful run, skipping: {rel}")
+            else:
+                pending.append(nb)
+        notebooks = pending
+        if not notebooks:
+            print("\nAll notebooks are up to date.")
+            return 0
+
+    jobs = int(os.getenv("NOTEBOOK_JOBS", "0")) or os.cpu_count() or 2
+    jobs = max(1, min(jobs, len(notebooks)))
+    print(f"Executing {len(notebooks)} notebook(s) with {jobs} worker(s)")
+
+    if fail_fast:
+        # Start with the smallest (usually quickest) notebooks so a failure shows
+        # up early and the expensive ones can still be cancelled.
+        notebooks.sort(key=_file_size)
+
+    runner = run_notebook if args.isolated else run_notebook_shared
+    _cancelled.clear()
+    failures: list[tuple[str, str]] = []
+
+    # Notebooks run in nbconvert processes or on their worker's kernel, so
+    # threads are enough to run them concurrently. Logs are printed per notebook
+    # once its task finishes.
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            if args.isolated and not fail_fast:
+                # Without fail-fast, batches can't lose anything: spread the
+                # notebooks over the workers in groups of up to BATCH_SIZE.
+                size = max(1, min(BATCH_SIZE, -(-len(notebooks) // jobs)))
+                futures = [
+                    executor.submit(run_notebook_batch, notebooks[i : i + size], timeout_seconds)
+                    for i in range(0, len(notebooks), size)
+                ]
+            else:
+                futures = [
+                    executor.submit(_run_single, runner, nb, timeout_seconds) for nb in notebooks
+                ]
+            for future in as_completed(futures):
+                for nb, output, msg in future.result():
+                    rel = nb.as_posix()[_ROOT_PREFIX_LEN:]
+                    print(f"\n=== Executed: {rel} ===")
+                    if output:
+                        print(output.rstrip())
+                    if msg:
+                        failures.append((rel, msg))
+                        exec_cache.pop(rel, None)
+                        print(msg)
+                        if fail_fast:
+                            _cancel_running()
+                            executor.shutdown(wait=True, cancel_futures=True)
+                            return 1
+                    elif hashes.get(nb):
+                        exec_cache[rel] = hashes[nb]
+    finally:
+        _shutdown_kernels()
+        if use_exec_cache:
+            try:
+                EXEC_CACHE_FILE.write_text(json.dumps(exec_cache, indent=1), encoding="utf-8")
+            except OSError as exc:
+                print(f"Could not write execution cache: {exc}")
 
     if failures:
         print("\nSome notebooks failed:")
@@ -12,69 +12,156 @@ Environment variables (optional):
 
 from __future__ import annotations
 
+import io
 import json
 import os
+import re
 from pathlib import Path
-from typing import Iterable
+from typing import Iterator
+from urllib.parse import quote as _quote
+
+from _nb_discovery import discover
+
+try:
+    # Optional: much faster parsing of large notebooks (only used when the whole
+    # file has to be parsed, see `notebook_title`).
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
 
 
 REPO_ROOT = Path(__file__).resolve().parents[2]
 DEFAULT_REPO_SLUG = "Deutsche-Digitale-Bibliothek/ddblabs-statistics"
 DEFAULT_BRANCH = "main"
-
-
-def iter_notebooks(root: Path) -> Iterable[Path]:
-    # Prefer notebooks in the repo root and in a conventional notebooks/ folder.
-    # Skip checkpoints and Quarto build outputs.
-    skip_parts = {".ipynb_checkpoints", "_site", ".quarto", ".git", ".github"}
-
-    for path in root.rglob("*.ipynb"):
-        if any(part in skip_parts for part in path.parts):
-            continue
-        # Don't include hidden folders
-        if any(part.startswith(".") and part not in {".github"} for part in path.parts):
-            # already filtered most dot folders, keep as extra guard
-            continue
-        yield path
+# Length of the "<repo root>/" prefix of every discovered notebook path.
+_ROOT_PREFIX_LEN = len(REPO_ROOT.as_posix()) + 1
+# Local cache of notebook titles, keyed by repo-relative path and validated
+# against the file's mtime/size, so unchanged notebooks are not parsed again.
+TITLE_CACHE_FILE = REPO_ROOT / ".github" / ".nb-title-cache.json"
+
+PAGE_HEADER = '---\ntitle: "Notebooks"\n---'
+
+_JSON_DECODER = json.JSONDecoder()
+_CELLS_START = re.compile(r'\s*\{\s*"cells"\s*:\s*\[')
+_CHUNK_SIZE = 64 * 1024
+
+
+def _iter_cells(notebook_path: Path) -> Iterator[dict]:
+    # Decode the cells one at a time while reading the file in chunks. Titles
+    # come from the first markdown cells, so the (possibly huge) outputs of later
+    # cells are never read or parsed. nbformat writes "cells" as the first key;
+    # anything else raises ValueError and the caller parses the whole file.
+    with notebook_path.open(encoding="utf-8") as f:
+        buf = f.read(_CHUNK_SIZE)
+        match = _CELLS_START.match(buf)
+        if not match:
+            raise ValueError("notebook does not start with a cells array")
+        pos = match.end()
+        eof = False
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                if buf[pos] == "]":
+                    return
+                try:
+                    cell, pos = _JSON_DECODER.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    yield cell
+                    continue
+            elif eof:
+                raise ValueError("unexpected end of notebook")
+            # The next cell is cut off at the end of the buffer: drop what has
+            # been consumed and read more (growing the reads for large cells).
+            buf = buf[pos:]
+            pos = 0
+            chunk = f.read(max(_CHUNK_SIZE, len(buf)))
+            eof = not chunk
+            buf += chunk
+
+
+def _cell_title(cell: dict, default: str) -> str | None:
+    if cell.get("cell_type") != "markdown":
+        return None
+    source = cell.get("source") or []
+    if isinstance(source, str):
+        lines = source.splitlines()
+    else:
+        lines = [str(s) for s in source]
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#"):
+            return line.lstrip("#").strip() or default
+    # fallback: first non-empty markdown line
+    for line in lines:
+        line = line.strip()
+        if line:
+            return line
+    return None
 
 
 def notebook_title(notebook_path: Path) -> str:
+    default = notebook_path.stem
+    try:
+        for cell in _iter_cells(notebook_path):
+            title = _cell_title(cell, default)
+            if title:
+                return title
+        return default
+    except Exception:
+        pass
+
     try:
-        data = json.loads(notebook_path.read_text(encoding="utf-8"))
+        data = _loads(notebook_path.read_bytes())
     except Exception:
-        return notebook_path.stem
+        return default
 
     for cell in data.get("cells", []):
-        if cell.get("cell_type") != "markdown":
-            continue
-        source = cell.get("source") or []
-        if isinstance(source, str):
-            lines = source.splitlines()
-        else:
-            lines = [str(s) for s in source]
-        for line in lines:
-            line = line.strip()
-            if line.startswith("#"):
-                return line.lstrip("#").strip() or notebook_path.stem
-        # fallback: first non-empty markdown line
-        for line in lines:
-            line = line.strip()
-            if line:
-                return line
-    return notebook_path.stem
+        title = _cell_title(cell, default)
+        if title:
+            return title
+    return default
 
 
-def url_escape_path(path: str) -> str:
-    # GitHub/nbviewer/binder accept URL-encoded paths. Keep it simple.
-    from urllib.parse import quote
+def _load_title_cache() -> dict[str, dict]:
+    try:
+        data = json.loads(TITLE_CACHE_FILE.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
 
-    return quote(path)
 
+def cached_notebook_title(notebook_path: Path, rel: str, cache: dict, updated: dict) -> str:
+    # Titles are derived from the file content only, so a matching mtime and size
+    # means the cached title is still valid. `updated` collects the entries of
+    # the current run; stale entries of removed notebooks are dropped that way.
+    try:
+        st = notebook_path.stat()
+    except OSError:
+        # e.g. a dangling symlink: nothing to cache, `notebook_title` falls back
+        # to the file name.
+        return notebook_title(notebook_path)
+    entry = cache.get(rel)
+    if (
+        isinstance(entry, dict)
+        and entry.get("mtime") == st.st_mtime_ns
+        and entry.get("size") == st.st_size
+        and isinstance(entry.get("title"), str)
+    ):
+        title = entry["title"]
+    else:
+        title = notebook_title(notebook_path)
+    updated[rel] = {"mtime": st.st_mtime_ns, "size": st.st_size, "title": title}
+    return title
 
-def url_escape(value: str) -> str:
-    from urllib.parse import quote
 
-    return quote(value, safe="")
+def url_escape(value: str, safe: str = "") -> str:
+    # GitHub/nbviewer/binder accept URL-encoded paths. Keep it simple: pass
+    # safe="/" for repo-relative paths, the default escapes everything.
+    return _quote(value, safe=safe)
 
 
 def choose_history_path(notebooks: list[Path]) -> str | None:
@@ -88,9 +175,9 @@ def choose_history_path(notebooks: list[Path]) -> str | None:
 
     for nb in notebooks:
         if nb.name in preferred:
-            return nb.relative_to(REPO_ROOT).as_posix()
+            return nb.as_posix()[_ROOT_PREFIX_LEN:]
 
-    return notebooks[0].relative_to(REPO_ROOT).as_posix()
+    return notebooks[0].as_posix()[_ROOT_PREFIX_LEN:]
 
 
 def main() -> int:
@@ -100,81 +187,96 @@ def main() -> int:
     repo_url = f"https://github.com/{repo_slug}"
     vscode_clone = f"vscode://vscode.git/clone?url={url_escape(repo_url + '.git')}"
 
-    notebooks = sorted(iter_notebooks(REPO_ROOT), key=lambda p: p.as_posix().lower())
+    # Every per-notebook URL is a fixed prefix followed by the escaped path.
+    github_prefix = f"{repo_url}/blob/{branch}/"
+    raw_prefix = f"https://raw.githubusercontent.com/{repo_slug}/{branch}/"
+    colab_prefix = f"https://colab.research.google.com/github/{repo_slug}/blob/{branch}/"
+    binder_prefix = f"https://mybinder.org/v2/gh/{repo_slug}/{branch}?filepath="
+    nbviewer_prefix = f"https://nbviewer.org/github/{repo_slug}/blob/{branch}/"
+    vscode_web_prefix = f"https://vscode.dev/github/{repo_slug}/blob/{branch}/"
+
+    notebooks = discover(REPO_ROOT)
     history_path = choose_history_path(notebooks)
+    title_cache = _load_title_cache()
+    updated_title_cache: dict[str, dict] = {}
 
-    lines: list[str] = []
-    lines += [
-        "---",
-        'title: "Notebooks"',
-        "---",
-    ]
+    # Each block after the header starts with the newline that separates it
+    # from the previous one.
+    buf = io.StringIO()
+    write = buf.write
+    write(PAGE_HEADER)
 
     if not notebooks:
-        lines += ["Keine Notebooks gefunden.", ""]
+        write("\nKeine Notebooks gefunden.\n")
     else:
-
         if history_path:
-            lines += [
-                "```{=html}",
-                f"<div class=\"nb-history-global\" data-repo-slug=\"{repo_slug}\" data-repo-branch=\"{branch}\" data-history-path=\"{history_path}\">",
-                "  <div class=\"nb-history-global-row\">",
-                "    <label class=\"form-label\" for=\"nb-history-global-select\">Historischer Stand:</label>",
-                "    <select class=\"form-select form-select-sm nb-history-select\" id=\"nb-history-global-select\">",
-                "      <option value=\"\">Aktuell</option>",
-                "    </select>",
-                "    <span class=\"nb-history-status\"></span>",
-                "  </div>",
-                "</div>",
-                "```",
-                "",
-            ]
-
-        lines += [
-            "",
-            "Hier sind die einzelnen Notebooks mit direkten Start-Links aufgelistet.",
-            "",
-        ]
+            write(
+                "\n```{=html}\n"
+                f"<div class=\"nb-history-global\" data-repo-slug=\"{repo_slug}\" data-repo-branch=\"{branch}\" data-history-path=\"{history_path}\">\n"
+                "  <div class=\"nb-history-global-row\">\n"
+                "    <label class=\"form-label\" for=\"nb-history-global-select\">Historischer Stand:</label>\n"
+                "    <select class=\"form-select form-select-sm nb-history-select\" id=\"nb-history-global-select\">\n"
+                "      <option value=\"\">Aktuell</option>\n"
+                "    </select>\n"
+                "    <span class=\"nb-history-status\"></span>\n"
+                "  </div>\n"
+                "</div>\n"
+                "```\n"
+            )
+
+        write("\n\nHier sind die einzelnen Notebooks mit direkten Start-Links aufgelistet.\n")
 
         for nb in notebooks:
-            rel = nb.relative_to(REPO_ROOT).as_posix()
-            rel_escaped = url_escape_path(rel)
-            title = notebook_title(nb)
+            rel = nb.as_posix()[_ROOT_PREFIX_LEN:]
+            rel_escaped = url_escape(rel, safe="/")
+            title = cached_notebook_title(nb, rel, title_cache, updated_title_cache)
 
             # Link to the rendered HTML page on GitHub Pages.
             # This page itself lives at `pages/notebooks.html`, so we need to go one level up.
-            rel_html = rel[:-6] + ".html" if rel.lower().endswith(".ipynb") else rel
-            page_href = "../" + url_escape_path(rel_html)
-
-            github_file = f"{repo_url}/blob/{branch}/{rel_escaped}"
-            raw_file = f"https://raw.githubusercontent.com/{repo_slug}/{branch}/{rel_escaped}"
-
-            colab = f"https://colab.research.google.com/github/{repo_slug}/blob/{branch}/{rel_escaped}"
-            binder = f"https://mybinder.org/v2/gh/{repo_slug}/{branch}?filepath={rel_escaped}"
-            nbviewer = f"https://nbviewer.org/github/{repo_slug}/blob/{branch}/{rel_escaped}"
-            vscode_web = f"https://vscode.dev/github/{repo_slug}/blob/{branch}/{rel_escaped}"
-
-            lines += [
-                f"### {title} <span class=\"nb-filename\">{rel}</span>",
-                "",
-                f"::: {{.launch-buttons data-nb-path=\"{rel}\"}}",
-                f"<a class=\"btn btn-sm btn-primary\" href=\"{page_href}\" title=\"Gerenderte Notebook-Seite auf dieser Website öffnen\">Seite</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-download\" href=\"{raw_file}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook-Datei (.ipynb) direkt herunterladen\">Download</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-github\" href=\"{github_file}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook auf GitHub ansehen\">GitHub</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-nbviewer\" href=\"{nbviewer}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook nur ansehen (nbviewer)\">nbviewer</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-vscodeweb\" href=\"{vscode_web}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in VS Code (Web) öffnen\">VS Code (Web)</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-colab\" href=\"{colab}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in Google Colab öffnen\">Colab</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary js-binder\" href=\"{binder}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in Binder starten (reproduzierbare Umgebung; Start kann dauern)\">Binder</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary\" href=\"{vscode_clone}\" title=\"Repository in lokalem VS Code öffnen/klonen (danach Notebook-Datei öffnen)\">VS Code (lokal)</a>",
-                f"<a class=\"btn btn-sm btn-outline-secondary\" href=\"x-github-client://openRepo/{repo_url}\" title=\"Repository in GitHub Desktop öffnen (GitHub Desktop muss lokal installiert sein)\">GitHub Desktop</a>",
-                ":::",
-                "",
-            ]
-
+            # Discovery only yields `*.ipynb` files, so the suffix is always there.
+            rel_html = rel[:-6] + ".html"
+            page_href = "../" + url_escape(rel_html, safe="/")
+
+            github_file = github_prefix + rel_escaped
+            raw_file = raw_prefix + rel_escaped
+
+            colab = colab_prefix + rel_escaped
+            binder = binder_prefix + rel_escaped
+            nbviewer = nbviewer_prefix + rel_escaped
+            vscode_web = vscode_web_prefix + rel_escaped
+
+            write(
+                f"\n### {title} <span class=\"nb-filename\">{rel}</span>\n"
+                "\n"
+                f"::: {{.launch-buttons data-nb-path=\"{rel}\"}}\n"
+                f"<a class=\"btn btn-sm btn-primary\" href=\"{page_href}\" title=\"Gerenderte Notebook-Seite auf dieser Website öffnen\">Seite</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-download\" href=\"{raw_file}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook-Datei (.ipynb) direkt herunterladen\">Download</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-github\" href=\"{github_file}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook auf GitHub ansehen\">GitHub</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-nbviewer\" href=\"{nbviewer}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook nur ansehen (nbviewer)\">nbviewer</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-vscodeweb\" href=\"{vscode_web}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in VS Code (Web) öffnen\">VS Code (Web)</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-colab\" href=\"{colab}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in Google Colab öffnen\">Colab</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary js-binder\" href=\"{binder}\" target=\"_blank\" rel=\"noopener noreferrer\" title=\"Notebook in Binder starten (reproduzierbare Umgebung; Start kann dauern)\">Binder</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary\" href=\"{vscode_clone}\" title=\"Repository in lokalem VS Code öffnen/klonen (danach Notebook-Datei öffnen)\">VS Code (lokal)</a>\n"
+                f"<a class=\"btn btn-sm btn-outline-secondary\" href=\"x-github-client://openRepo/{repo_url}\" title=\"Repository in GitHub Desktop öffnen (GitHub Desktop muss lokal installiert sein)\">GitHub Desktop</a>\n"
+                ":::\n"
+            )
+
+    # Only touch the page if its content changed, so the mtime stays put and
+    # Quarto doesn't re-render it for nothing.
     out_path = REPO_ROOT / "pages" / "notebooks.qmd"
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    out_path.write_text("\n".join(lines), encoding="utf-8")
-    print(f"Wrote {out_path}")
+    content = buf.getvalue().encode("utf-8")
+    if out_path.exists() and out_path.read_bytes() == content:
+        print(f"{out_path} is up to date")
+    else:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_bytes(content)
+        print(f"Wrote {out_path}")
+
+    if updated_title_cache != title_cache:
+        try:
+            TITLE_CACHE_FILE.write_text(json.dumps(updated_title_cache, indent=1), encoding="utf-8")
+        except OSError as exc:
+            print(f"Could not write title cache: {exc}")
     return 0
 
 